@@ -167,6 +167,15 @@ def initialize_database(app):
                     logger.debug(f"Existing columns: {existing_columns}")
                     needs_migration = True
                     break
+                
+                # Indexes added to a model are created by the generated migration
+                expected_indexes = {i.name for i in current_metadata.tables[table].indexes}
+                existing_indexes = {i['name'] for i in inspector.get_indexes(table)}
+                
+                if missing_indexes := expected_indexes - existing_indexes:
+                    logger.info(f"Missing indexes detected in table {table}: {missing_indexes}")
+                    needs_migration = True
+                    break
             
             if needs_migration:
                 logger.info("Generating and applying database migrations")
@@ -185,6 +194,9 @@ def initialize_database(app):
 # Configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'query_cache_size': 1200  # Compiled statement cache shared by all connections
+}
 app.config['WTF_CSRF_ENABLED'] = True
 
 # Initialize extensions
@@ -360,6 +372,8 @@ def login():
         user = User.query.filter_by(username=form.username.data).first()
         
         if user and user.check_password(form.password.data):
+            # Persist the password hash if check_password upgraded it
+            db.session.commit()
             login_user(user)
             flash('Logged in successfully.', 'success')
             return redirect(url_for('dashboard'))
@@ -443,7 +457,7 @@ def create_user():
 @login_required
 @admin_required
 def edit_user(user_id):
-    user = User.query.get_or_404(user_id)
+    user = db.get_or_404(User, user_id)
     if user.id == current_user.id:
         return jsonify({'error': 'Cannot edit your own user through this interface'}), 400
     
@@ -477,7 +491,7 @@ def edit_user(user_id):
 @login_required
 @admin_required
 def deactivate_user(user_id):
-    user = User.query.get_or_404(user_id)
+    user = db.get_or_404(User, user_id)
     if user.id == current_user.id:
         return jsonify({'error': 'Cannot deactivate your own account'}), 400
     
@@ -488,7 +502,7 @@ def deactivate_user(user_id):
 @login_required
 @admin_required
 def activate_user(user_id):
-    user = User.query.get_or_404(user_id)
+    user = db.get_or_404(User, user_id)
     user.activate()
     return api_response('User activated successfully')
 
@@ -496,7 +510,7 @@ def activate_user(user_id):
 @login_required
 @admin_required
 def get_user(user_id):
-    user = User.query.get_or_404(user_id)
+    user = db.get_or_404(User, user_id)
     return api_response('User details retrieved successfully', user=user.to_dict())
 
 class ProfileForm(FlaskForm):
@@ -568,7 +582,7 @@ def new_task():
                 # Schedule the task if it has a schedule
                 if task.schedule:
                     logger.info(f"Scheduling task with schedule: {task.schedule}")
-                    scheduler.schedule_task(task)
+                    scheduler.schedule_task(task.id, task.schedule)
                 
                 return api_response('Task created successfully', redirect=url_for('tasks'))
                 
@@ -629,10 +643,10 @@ def edit_task(task):
                 if new_schedule != old_schedule:
                     if new_schedule:
                         logger.info(f"Updating schedule for task {task.id}: {new_schedule}")
-                        scheduler.schedule_task(task)
+                        scheduler.schedule_task(task.id, task.schedule)
                     else:
                         logger.info(f"Removing schedule for task {task.id}")
-                        scheduler.remove_task(task)
+                        scheduler.remove_task(task.id)
                 
                 return api_response('Task updated successfully', redirect=url_for('tasks'))
                 
@@ -670,7 +684,7 @@ def edit_task(task):
 @app.route('/tasks/<int:task_id>')
 @login_required
 def view_task(task_id):
-    task = Task.query.get_or_404(task_id)
+    task = db.get_or_404(Task, task_id)
     if task.user_id != current_user.id:
         flash('Access denied.', 'danger')
         return redirect(url_for('tasks'))
@@ -693,7 +707,7 @@ def view_task(task_id):
     return render_template('view_task.html',
         task=task,
         parameters=parameters,
-        block_chain=task.get_block_chain(),
+        block_chain=task.get_block_chain(strict=False),
         block_data=task.get_block_data()
     )
 
@@ -706,6 +720,9 @@ def run_task(task):
             task = session.merge(task)
             task.update_status('running')
             
+            # Commit the status before the worker thread reads the task
+            session.commit()
+            
             # Run task in background thread
             thread = threading.Thread(target=run_in_thread, args=(app, task.id))
             thread.daemon = True
@@ -817,7 +834,7 @@ def delete_task(task):
             task = session.merge(task)
             
             # Remove task from scheduler if scheduled
-            scheduler.remove_task(task)
+            scheduler.remove_task(task.id)
             
             # Delete the task
             session.delete(task)
@@ -168,7 +168,8 @@ class BlockManager:
         }
         block_outputs = {}
         
-        for block in task.blocks:
+        # Run blocks in dependency order so every input is produced before it is read
+        for block in task.get_block_chain():
             logger.info(f"Executing {block.type} block {block.name}")
             block_instance = self.get_block(block.type, block.name)()
             block_params = block.get_parameters()
@@ -82,29 +82,17 @@ class UpdateFilter(ProcessingBlock):
         
         logger.info(f"Processing {len(data)} items for task {task_id}")
         
-        # Process each item
+        # Hash every item, then record all of them in one round-trip per chunk
+        item_hashes = [self._get_item_hash(item, exclude_fields) for item in data]
+        new_hashes = ItemState.bulk_mark_new(task_id, item_hashes)
+        
+        # Only include new items in the output (first occurrence of each hash)
         new_items = []
-        for item in data:
-            # Create hash from all fields except excluded ones
-            item_hash = self._get_item_hash(item, exclude_fields)
-            
-            # Check if this item has been seen before
-            existing_state = ItemState.query.filter_by(
-                task_id=task_id,
-                item_hash=item_hash
-            ).first()
-            
-            # Only include new items in the output
-            if existing_state is None:
+        for item, item_hash in zip(data, item_hashes):
+            if item_hash in new_hashes:
                 logger.debug(f"New item found with hash {item_hash}")
                 new_items.append(item)
-                
-                # Create state record for the new item
-                state = ItemState(
-                    task_id=task_id,
-                    item_hash=item_hash
-                )
-                db.session.add(state)
+                new_hashes.discard(item_hash)
             else:
                 logger.debug(f"Skipping previously seen item with hash {item_hash}")
         
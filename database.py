@@ -4,45 +4,63 @@ import threading
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy import event
 
-# Thread local storage for database sessions
+# Process-wide session registry, built once on first use. scoped_session
+# already hands out one session per thread, so no per-thread factory is needed.
+_session_registry = None
+_registry_lock = threading.Lock()
+
+# Thread local storage for session_scope nesting depth
 thread_local = threading.local()
 
 def get_session():
-    """Get or create a scoped database session for the current thread"""
-    if not hasattr(thread_local, 'session'):
-        # Create a new scoped session with SQLAlchemy 2.0 compatible settings
-        session_factory = sessionmaker(
-            bind=db.engine,
-            autocommit=False,
-            autoflush=False,
-            expire_on_commit=False  # Prevent detached instance errors
-        )
-        thread_local.session = scoped_session(session_factory)
-        
-        # Set up session events for cleanup
-        @event.listens_for(thread_local.session, 'after_commit')
-        def after_commit(session):
-            """Expire all instances after commit to ensure fresh data"""
-            session.expire_all()
-        
-        @event.listens_for(thread_local.session, 'after_rollback')
-        def after_rollback(session):
-            """Expire all instances after rollback"""
-            session.expire_all()
-    
-    return thread_local.session
+    """Get the scoped database session for the current thread"""
+    global _session_registry
+    if _session_registry is None:
+        with _registry_lock:
+            if _session_registry is None:
+                # Create the scoped session with SQLAlchemy 2.0 compatible settings
+                session_factory = sessionmaker(
+                    bind=db.engine,
+                    autocommit=False,
+                    autoflush=False,
+                    expire_on_commit=False  # Prevent detached instance errors
+                )
+                registry = scoped_session(session_factory)
+
+                # Set up session events for cleanup
+                @event.listens_for(registry, 'after_commit')
+                def after_commit(session):
+                    """Expire all instances after commit to ensure fresh data"""
+                    session.expire_all()
+
+                @event.listens_for(registry, 'after_rollback')
+                def after_rollback(session):
+                    """Expire all instances after rollback"""
+                    session.expire_all()
+
+                _session_registry = registry
+
+    return _session_registry
 
 @contextmanager
 def session_scope():
-    """Provide a transactional scope around a series of operations."""
+    """Provide a transactional scope around a series of operations.
+
+    Nested scopes share the thread's session; only the outermost scope commits.
+    """
     session = get_session()
+    depth = getattr(thread_local, 'depth', 0)
+    thread_local.depth = depth + 1
     try:
         yield session
-        session.commit()
+        if depth == 0:
+            session.commit()
     except:
         session.rollback()
         raise
     finally:
-        # Just expire the objects but don't remove the session
-        # This allows the session to be reused within the same request
-        session.expire_all() 
\ No newline at end of file
+        thread_local.depth = depth
+        if depth == 0:
+            # Just expire the objects but don't remove the session
+            # This allows the session to be reused within the same request
+            session.expire_all()
@@ -1,15 +1,24 @@
 import logging
 from datetime import datetime
 from typing import Dict, Any, Optional, List
-import json
 import time
+import threading
+from collections import deque
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-import json
-from sqlalchemy import event
-from sqlalchemy.orm import scoped_session
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHash
+import orjson
+from sqlalchemy import event, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import scoped_session, object_session
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import Text, TypeDecorator
 from contextlib import contextmanager
 
 # Initialize logger
@@ -18,6 +27,78 @@ logger = logging.getLogger(__name__)
 # Initialize SQLAlchemy with thread-safe session
 db = SQLAlchemy()
 
+def json_dumps(obj):
+    """Serialize obj to a JSON string (drivers bind JSON as text, so decode the bytes)"""
+    return orjson.dumps(obj).decode()
+
+json_loads = orjson.loads
+
+class JSONText(TypeDecorator):
+    """JSON value stored in a Text column, encoded and decoded with orjson
+    
+    Keeps the existing TEXT storage on every backend, so no column type change
+    is needed, while callers work with parsed values.
+    """
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return None if value is None else json_dumps(value)
+    
+    def process_result_value(self, value, dialect):
+        if not value:
+            return None
+        try:
+            return json_loads(value)
+        except orjson.JSONDecodeError:
+            # Rows written before values were always JSON-encoded hold raw strings
+            return value
+
+class utcnow(FunctionElement):
+    """Current UTC time evaluated by the database
+    
+    Matches the naive UTC datetimes written from Python (datetime.utcnow()),
+    and keeps sub-second precision on SQLite, whose CURRENT_TIMESTAMP only has
+    whole seconds.
+    """
+    type = db.DateTime()
+    inherit_cache = True
+
+@compiles(utcnow)
+def _default_utcnow(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+@compiles(utcnow, 'postgresql')
+def _postgresql_utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+@compiles(utcnow, 'sqlite')
+def _sqlite_utcnow(element, compiler, **kw):
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Argon2id hasher for user passwords. Hashes created by the previous werkzeug
+# scheme are verified with werkzeug and upgraded on the next successful login.
+password_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=4)
+
+# Allowed values for Block.type. Stored as VARCHAR(20) like before on every backend,
+# so schema comparison sees no type change; the CHECK constraint is only created
+# with new tables, existing databases keep their unconstrained column.
+BlockType = db.Enum(
+    'input', 'processing', 'action',
+    name='block_type', native_enum=False, length=20, create_constraint=True
+)
+
+# Process-local cache of Settings values: key -> (value, expires_at)
+SETTINGS_CACHE_TTL = 60  # seconds
+_settings_cache = {}
+_settings_cache_lock = threading.Lock()
+
+# Dialect-specific INSERT constructs that support ON CONFLICT upserts
+_UPSERT_INSERTS = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert,
+}
+
 # Models
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -26,15 +107,37 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(128))
     is_admin = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow())
     last_login = db.Column(db.DateTime)
-    tasks = db.relationship('Task', backref='user', lazy=True)
+    tasks = db.relationship('Task', back_populates='user', lazy=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Verify a password, rehashing it if the stored hash is outdated
+        
+        The caller is responsible for committing the session so an upgraded
+        hash is persisted.
+        """
+        if not self.password_hash:
+            return False
+        
+        if not self.password_hash.startswith('$argon2'):
+            # Legacy werkzeug hash
+            if not check_password_hash(self.password_hash, password):
+                return False
+            self.set_password(password)
+            return True
+        
+        try:
+            password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHash):
+            return False
+        
+        if password_hasher.check_needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
     
     def update_last_login(self):
         from database import session_scope
@@ -84,46 +187,71 @@ class Task(db.Model):
     schedule = db.Column(db.String(100))
     status = db.Column(db.String(20), default='pending')
     last_run = db.Column(db.DateTime)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow())
     version = db.Column(db.Integer, default=1)  # For optimistic locking
     
     # Relationships
-    blocks = db.relationship('Block', backref='task', lazy=True, cascade='all, delete-orphan')
-    item_states = db.relationship('ItemState', backref='task', lazy=True, cascade='all, delete-orphan')
+    user = db.relationship('User', back_populates='tasks', lazy='noload')
+    blocks = db.relationship('Block', back_populates='task', lazy='selectin', cascade='all, delete-orphan')
+    item_states = db.relationship('ItemState', back_populates='task', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # Partial index: only active tasks are looked up by status
+        db.Index(
+            'idx_tasks_active_status', 'status',
+            postgresql_where=status.in_(('pending', 'running')),
+            sqlite_where=status.in_(('pending', 'running'))
+        ),
+    )
     
     def update_status(self, new_status, max_retries=3):
-        """Thread-safe status update with optimistic locking and retries"""
-        from database import session_scope
-        last_error = None
+        """Thread-safe status update with optimistic locking and retries
+        
+        Issues a single UPDATE guarded by the expected version; if another
+        transaction bumped the version first, the new version is read back and
+        the update is retried. A version miss matches no rows, so it never rolls
+        back the caller's pending changes in a shared session.
+        """
+        from database import session_scope, thread_local
+        # Inside an enclosing session_scope the UPDATE is only committed with it
+        nested = getattr(thread_local, 'depth', 0) > 0
+        expected_version = self.version
         
         for attempt in range(max_retries):
-            try:
-                with session_scope() as session:
-                    task = session.merge(self)
-                    current_version = task.version
-                    task.status = new_status
-                    task.version += 1
-                    session.flush()
-                    
-                    # Verify no other transaction has modified this record
-                    if task.version != current_version + 1:
-                        session.rollback()
-                        raise Exception("Task was modified by another transaction")
-                    
-                    # If we got here, the update was successful
-                    logger.info(f"Successfully updated task {task.id} status to {new_status} (attempt {attempt + 1})")
-                    return True
-                    
-            except Exception as e:
-                last_error = e
-                logger.warning(f"Failed to update task {self.id} status on attempt {attempt + 1}: {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(0.1 * (attempt + 1))  # Exponential backoff
-                continue
+            with session_scope() as session:
+                result = session.execute(
+                    update(Task)
+                    .where(Task.id == self.id, Task.version == expected_version)
+                    .values(status=new_status, version=Task.version + 1)
+                    .execution_options(synchronize_session=False)
+                )
+                updated = result.rowcount > 0
+                
+                if not updated:
+                    # Another transaction modified this record; retry against its version
+                    expected_version = session.execute(
+                        select(Task.version).where(Task.id == self.id)
+                    ).scalar_one()
+            
+            if updated:
+                if nested:
+                    # Not committed yet; reload from the open transaction on next access
+                    session = object_session(self)
+                    if session is not None:
+                        session.expire(self, ['status', 'version'])
+                else:
+                    set_committed_value(self, 'status', new_status)
+                    set_committed_value(self, 'version', expected_version + 1)
+                logger.info(f"Successfully updated task {self.id} status to {new_status} (attempt {attempt + 1})")
+                return True
+            
+            logger.warning(f"Task {self.id} was modified by another transaction on attempt {attempt + 1}")
+            if attempt < max_retries - 1:
+                time.sleep(0.1 * (attempt + 1))  # Exponential backoff
         
         # If we got here, all retries failed
         logger.error(f"Failed to update task {self.id} status after {max_retries} attempts")
-        raise last_error
+        raise Exception("Task was modified by another transaction")
     
     def get_block_data(self):
         """Get data for all blocks"""
@@ -134,12 +262,9 @@ class Task(db.Model):
         }
         
         for block in self.blocks:
-            if block.data:
-                try:
-                    data = json.loads(block.data)
-                    block_data[block.type][block.name] = data
-                except (json.JSONDecodeError, TypeError):
-                    continue
+            # The JSON column hands back already-parsed data
+            if block.data is not None:
+                block_data[block.type][block.name] = block.data
         
         return block_data
     
@@ -149,23 +274,47 @@ class Task(db.Model):
         Args:
             results: Dictionary containing results for each block type
         """
+        # Index blocks once instead of scanning them for every result
+        blocks_by_key = {(b.type, b.name): b for b in self.blocks}
+        
+        session = object_session(self)
+        if session is None:
+            # Not attached to a session, nothing to write in bulk
+            for block_type, type_results in results.items():
+                for block_name, block_data in type_results.items():
+                    block = blocks_by_key.get((block_type, block_name))
+                    if block:
+                        block.set_data(block_data)
+            return
+        
+        # Collect all changes and write them in a single executemany UPDATE
+        updated_blocks = []
+        mappings = []
         for block_type, type_results in results.items():
             for block_name, block_data in type_results.items():
-                # Find the block
-                block = next((b for b in self.blocks 
-                            if b.type == block_type and b.name == block_name), None)
+                block = blocks_by_key.get((block_type, block_name))
                 if block:
-                    block.set_data(block_data)
+                    if block_data == block.data:
+                        # Unchanged output, skip the write
+                        continue
+                    updated_blocks.append((block, block_data))
+                    mappings.append({'id': block.id, 'data': block_data})
+        
+        if not mappings:
+            return
+        
+        session.execute(update(Block), mappings)
+        
+        # Keep the loaded instances in sync without marking them dirty
+        for block, block_data in updated_blocks:
+            set_committed_value(block, 'data', block_data)
 
-    def get_block_chain(self):
-        """Get blocks in execution order (input -> processing -> action)
+    def _order_blocks(self, blocks_by_id):
+        """Order blocks input -> processing (by dependency) -> action
         
         Returns:
-            List of blocks in execution order, with each block containing its connections
+            Tuple of (ordered blocks, sorted ids of processing blocks stuck in a cycle)
         """
-        # Create a map of block_id -> block for easy lookup
-        blocks_by_id = {block.id: block for block in self.blocks}
-        
         # Create dependency graph
         dependencies = {}  # block_id -> set of block_ids it depends on
         for block in self.blocks:
@@ -192,48 +341,76 @@ class Task(db.Model):
         # First add input blocks (they have no dependencies)
         execution_chain.extend(input_blocks)
         
-        # Add processing blocks in dependency order
-        while processing_blocks:
-            # Find blocks whose dependencies are all satisfied
-            ready_blocks = [
-                block for block in processing_blocks
-                if all(dep_id in {b.id for b in execution_chain} for dep_id in dependencies[block.id])
-            ]
-            
-            if not ready_blocks and processing_blocks:
-                # We have blocks but none are ready - must be a cycle
-                break
-            
-            # Add ready blocks to chain
-            for block in ready_blocks:
-                execution_chain.append(block)
-                processing_blocks.remove(block)
+        # Add processing blocks in dependency order (Kahn's algorithm)
+        satisfied = {block.id for block in input_blocks}
+        unmet_counts = {}  # block_id -> number of unsatisfied dependencies
+        dependents = {}    # block_id -> processing block_ids waiting on it
+        for block in processing_blocks:
+            unmet = dependencies[block.id] - satisfied
+            unmet_counts[block.id] = len(unmet)
+            for dep_id in unmet:
+                dependents.setdefault(dep_id, []).append(block.id)
+        
+        ready = deque(block for block in processing_blocks if unmet_counts[block.id] == 0)
+        while ready:
+            block = ready.popleft()
+            execution_chain.append(block)
+            for dependent_id in dependents.get(block.id, ()):
+                unmet_counts[dependent_id] -= 1
+                if unmet_counts[dependent_id] == 0:
+                    ready.append(blocks_by_id[dependent_id])
+        
+        # Processing blocks still waiting on a dependency are part of a cycle
+        unresolved = sorted(block_id for block_id, count in unmet_counts.items() if count)
         
         # Finally add action blocks
         execution_chain.extend(action_blocks)
         
+        return execution_chain, unresolved
+
+    def get_block_chain(self, strict=True):
+        """Get blocks in execution order (input -> processing -> action)
+        
+        Args:
+            strict: Raise if some processing blocks can never run (dependency cycle).
+                When False, those blocks are logged and left out of the chain.
+        
+        Returns:
+            List of blocks in execution order, with each block containing its connections
+            
+        Raises:
+            ValueError: If strict and the processing blocks contain a cycle
+        """
+        # Create a map of block_id -> block for easy lookup
+        blocks_by_id = {block.id: block for block in self.blocks}
+        
+        execution_chain, unresolved = self._order_blocks(blocks_by_id)
+        
+        if unresolved:
+            # Whatever is left can never become ready - must be a cycle
+            logger.error(f"Cycle detected in task {self.id} among processing blocks {list(unresolved)}")
+            if strict:
+                raise ValueError(f"Cycle detected among blocks {list(unresolved)}")
+        
         # Add connection information to each block
-        for block in execution_chain:
+        for block in blocks_by_id.values():
             block.input_connections = []
             block.output_connections = []
-            
-            # Add input connections
+        
+        # One pass over the input edges fills both ends of every connection
+        for block in blocks_by_id.values():
             for conn in block.inputs:
-                if conn.source_block_id in blocks_by_id:
-                    source_block = blocks_by_id[conn.source_block_id]
-                    block.input_connections.append({
-                        'source_block': source_block,
-                        'input_name': conn.input_name
-                    })
-            
-            # Add output connections
-            for conn in block.outputs:
-                if conn.target_block_id in blocks_by_id:
-                    target_block = blocks_by_id[conn.target_block_id]
-                    block.output_connections.append({
-                        'target_block': target_block,
-                        'input_name': conn.input_name
-                    })
+                source_block = blocks_by_id.get(conn.source_block_id)
+                if source_block is None:
+                    continue
+                block.input_connections.append({
+                    'source_block': source_block,
+                    'input_name': conn.input_name
+                })
+                source_block.output_connections.append({
+                    'target_block': block,
+                    'input_name': conn.input_name
+                })
         
         return execution_chain
 
@@ -244,49 +421,53 @@ class Block(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     task_id = db.Column(db.Integer, db.ForeignKey('tasks.id', ondelete='CASCADE'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
-    type = db.Column(db.String(20), nullable=False)  # 'input', 'processing', or 'action'
+    type = db.Column(BlockType, nullable=False)  # 'input', 'processing', or 'action'
     display_name = db.Column(db.String(100))  # Display name for the block
-    parameters = db.Column(db.Text)  # JSON string of parameters
-    data = db.Column(db.Text)  # JSON string of block output data
+    parameters = db.Column(JSONText)  # Block parameters
+    data = db.Column(JSONText)  # Block output data
     position_x = db.Column(db.Float)  # For UI positioning
     position_y = db.Column(db.Float)  # For UI positioning
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow())
     
     # Relationships
+    task = db.relationship('Task', back_populates='blocks', lazy='noload')
     outputs = db.relationship(
         'BlockConnection',
         foreign_keys='BlockConnection.source_block_id',
-        backref='source_block',
+        back_populates='source_block',
         lazy=True,
         cascade='all, delete-orphan'
     )
     inputs = db.relationship(
         'BlockConnection',
         foreign_keys='BlockConnection.target_block_id',
-        backref='target_block',
-        lazy=True,
+        back_populates='target_block',
+        lazy='selectin',
         cascade='all, delete-orphan'
     )
     
+    __table_args__ = (
+        db.Index('idx_blocks_task_type', 'task_id', 'type'),  # For per-type block lookups within a task
+    )
+    
     def set_parameters(self, parameters):
         """Set block parameters"""
-        if isinstance(parameters, dict):
-            parameters = json.dumps(parameters)
+        if isinstance(parameters, str):
+            parameters = json_loads(parameters)
         self.parameters = parameters
     
     def get_parameters(self):
         """Get block parameters"""
-        return json.loads(self.parameters) if self.parameters else {}
+        # Copy so callers can add runtime keys without touching the column value
+        return dict(self.parameters) if self.parameters else {}
     
     def set_data(self, data):
         """Set block output data"""
-        if isinstance(data, (dict, list)):
-            data = json.dumps(data)
         self.data = data
     
     def get_data(self):
         """Get block output data"""
-        return json.loads(self.data) if self.data else None
+        return self.data
 
 class BlockConnection(db.Model):
     """Model representing a connection between blocks"""
@@ -296,7 +477,21 @@ class BlockConnection(db.Model):
     source_block_id = db.Column(db.Integer, db.ForeignKey('blocks.id', ondelete='CASCADE'), nullable=False)
     target_block_id = db.Column(db.Integer, db.ForeignKey('blocks.id', ondelete='CASCADE'), nullable=False)
     input_name = db.Column(db.String(50))  # Name of the input on the target block (for blocks with multiple inputs)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow())
+    
+    # Relationships
+    source_block = db.relationship(
+        'Block',
+        foreign_keys=[source_block_id],
+        back_populates='outputs',
+        lazy='noload'
+    )
+    target_block = db.relationship(
+        'Block',
+        foreign_keys=[target_block_id],
+        back_populates='inputs',
+        lazy='noload'
+    )
     
     __table_args__ = (
         db.UniqueConstraint('source_block_id', 'target_block_id', 'input_name', name='unique_connection'),
@@ -309,7 +504,10 @@ class ItemState(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     task_id = db.Column(db.Integer, db.ForeignKey('tasks.id', ondelete='CASCADE'), nullable=False)
     item_hash = db.Column(db.String(64), nullable=False)  # SHA-256 hash is 64 chars
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow(), server_default=utcnow())
+
+    # Relationships
+    task = db.relationship('Task', back_populates='item_states', lazy='noload')
 
     # Create indexes
     __table_args__ = (
@@ -320,40 +518,108 @@ class ItemState(db.Model):
     def __repr__(self):
         return f'<ItemState {self.task_id}:{self.item_hash}>'
 
+    @staticmethod
+    def bulk_mark_new(task_id, item_hashes, chunk_size=500):
+        """Record item hashes for a task and return the ones not seen before
+        
+        The unique (task_id, item_hash) index does the dedupe: each chunk is one
+        INSERT ... ON CONFLICT DO NOTHING RETURNING on SQLite/PostgreSQL. Changes
+        are left for the caller to commit.
+        
+        Args:
+            task_id: ID of the task the items belong to
+            item_hashes: Iterable of item hashes
+            chunk_size: Maximum number of rows per INSERT statement
+            
+        Returns:
+            Set of hashes that were newly recorded
+        """
+        hashes = list(dict.fromkeys(item_hashes))
+        new_hashes = set()
+        if not hashes:
+            return new_hashes
+        
+        session = db.session
+        table = ItemState.__table__
+        insert_ = _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+        for start in range(0, len(hashes), chunk_size):
+            chunk = hashes[start:start + chunk_size]
+            if insert_ is not None:
+                stmt = (
+                    insert_(table)
+                    .values([{'task_id': task_id, 'item_hash': item_hash} for item_hash in chunk])
+                    .on_conflict_do_nothing(index_elements=['task_id', 'item_hash'])
+                    .returning(table.c.item_hash)
+                )
+                new_hashes.update(session.execute(stmt).scalars())
+            else:
+                seen = set(session.execute(
+                    select(ItemState.item_hash).where(
+                        ItemState.task_id == task_id,
+                        ItemState.item_hash.in_(chunk)
+                    )
+                ).scalars())
+                fresh = [item_hash for item_hash in chunk if item_hash not in seen]
+                session.add_all(ItemState(task_id=task_id, item_hash=item_hash) for item_hash in fresh)
+                new_hashes.update(fresh)
+        
+        return new_hashes
+
 class Settings(db.Model):
     __tablename__ = 'settings'
     key = db.Column(db.String(50), primary_key=True)
     value = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow())
+    updated_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow())
     version = db.Column(db.Integer, default=1)  # For optimistic locking
 
     @staticmethod
     def get_setting(key, default=None):
+        cached = _settings_cache.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        
         from database import session_scope
         with session_scope() as session:
-            setting = session.query(Settings).get(key)
-            return setting.value if setting else default
+            row = session.execute(
+                select(Settings.value).where(Settings.key == key)
+            ).first()
+            if row is None:
+                return default
+            value = row[0]
+        
+        with _settings_cache_lock:
+            _settings_cache[key] = (value, time.monotonic() + SETTINGS_CACHE_TTL)
+        return value
 
     @staticmethod
     def set_setting(key, value):
         from database import session_scope
         with session_scope() as session:
-            setting = session.query(Settings).get(key)
-            if setting:
-                current_version = setting.version
-                setting.value = value
-                setting.version += 1
-                session.flush()
-                
-                # Verify no other transaction has modified this record
-                if setting.version != current_version + 1:
-                    session.rollback()
-                    raise Exception("Setting was modified by another transaction")
+            insert_ = _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+            if insert_ is not None:
+                # Single round-trip; the database resolves concurrent writers
+                stmt = insert_(Settings).values(key=key, value=value, version=1)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[Settings.key],
+                    set_={
+                        'value': stmt.excluded.value,
+                        'version': Settings.version + 1,
+                        'updated_at': utcnow()
+                    }
+                )
+                session.execute(stmt)
             else:
-                setting = Settings(key=key, value=value)
-                session.add(setting)
-            return setting
+                setting = session.get(Settings, key)
+                if setting:
+                    setting.value = value
+                    setting.version += 1
+                else:
+                    session.add(Settings(key=key, value=value))
+        
+        # Only refresh the cache once the write has been committed
+        with _settings_cache_lock:
+            _settings_cache[key] = (value, time.monotonic() + SETTINGS_CACHE_TTL)
 
 # Removed plugin registration code
 
@@ -1,30 +1,74 @@
 import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime
+from functools import lru_cache
 import logging
+import os
 from typing import Optional, Dict, Any
 import threading
-import traceback
-import json
 
+from apscheduler.jobstores.base import JobLookupError
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.base import STATE_RUNNING
 from apscheduler.triggers.cron import CronTrigger
-from sqlalchemy import and_
+from sqlalchemy import select, update
 from flask import Flask
 
+try:
+    import uvloop
+except ImportError:  # Not available on Windows; use the stdlib event loop
+    uvloop = None
+
 from models import Task, db
 from blocks.manager import manager
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=256)
+def _cron_trigger(schedule: str) -> CronTrigger:
+    """Parse a crontab string, reusing the trigger for repeated schedules
+    
+    CronTrigger is not modified after construction, so one instance can be
+    shared by every job with the same schedule.
+    """
+    return CronTrigger.from_crontab(schedule)
+
+# Built once and reused on every startup; only the columns needed to add a job
+_SCHEDULED_TASKS_QUERY = (
+    select(Task.id, Task.schedule)
+    .where(Task.schedule.isnot(None), Task.schedule != '')
+    .execution_options(yield_per=500)
+)
+
 class TaskScheduler:
     """Scheduler for running tasks on a schedule"""
     
     def __init__(self):
         logger.info("Initializing TaskScheduler")
-        self._running_tasks = {}
+        self._running_tasks = {}  # task_id -> Future of the current run
+        self._scheduled_crontabs: Dict[int, str] = {}  # task_id -> schedule of its current job
+        # Runs beyond this many in flight are skipped rather than queued without bound
+        self._max_inflight = int(os.environ.get('TASKFLOW_MAX_INFLIGHT', 64))
         self.scheduler = BackgroundScheduler()
+        # Reused worker threads for task runs; also bounds how many run at once
+        self._worker_state = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get('TASKFLOW_THREAD_POOL_SIZE', 32)),
+            thread_name_prefix='Task',
+            initializer=self._init_worker
+        )
         self.app = None
-        self._cleanup_lock = threading.Lock()
+    
+    def _init_worker(self):
+        """Give each worker thread its own event loop, reused for every run on that thread"""
+        loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._worker_state.loop = loop
+        
+        # Likewise one app context for the thread's lifetime rather than one per run
+        app_context = self.app.app_context()
+        app_context.push()
+        self._worker_state.app_context = app_context
     
     def init_app(self, app: Flask):
         """Initialize the scheduler with Flask app
@@ -43,29 +87,16 @@ class TaskScheduler:
             
         try:
             with self.app.app_context():
-                # Query for all tasks that have a schedule
-                tasks = Task.query.filter(
-                    and_(
-                        Task.schedule.isnot(None),
-                        Task.schedule != ''
-                    )
-                ).all()
+                # Plain (id, schedule) rows for all tasks that have a schedule, streamed in batches
+                rows = db.session.execute(_SCHEDULED_TASKS_QUERY)
                 
-                logger.info(f"Found {len(tasks)} scheduled tasks in database")
+                # Schedule all tasks as one batch; nothing is scheduled yet at startup
+                count = self.schedule_tasks(rows, assume_new=True)
                 
-                # Schedule each task
-                for task in tasks:
-                    try:
-                        self.schedule_task(task)
-                    except Exception as e:
-                        logger.error(f"Failed to schedule existing task {task.id}: {str(e)}")
-                        logger.error(f"Traceback: {traceback.format_exc()}")
-                        continue
-                
-                return len(tasks)
+                logger.info("Found %s scheduled tasks in database", count)
+                return count
         except Exception as e:
-            logger.error(f"Error loading existing tasks: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error loading existing tasks: %s", e)
             return 0
     
     def start(self):
@@ -82,17 +113,17 @@ class TaskScheduler:
             # Load and schedule existing tasks
             num_tasks = self._load_existing_tasks()
             
-            # Log currently scheduled jobs
-            jobs = self.scheduler.get_jobs()
-            logger.info(f"Loaded {num_tasks} tasks from database")
-            logger.info(f"Currently scheduled jobs: {len(jobs)}")
-            for job in jobs:
-                next_run = job.next_run_time.strftime('%Y-%m-%d %H:%M:%S') if job.next_run_time else 'None'
-                logger.info(f"Job ID: {job.id}, Next run time: {next_run}")
+            # Log currently scheduled jobs; listing them is only worth it at DEBUG
+            logger.info("Loaded %s tasks from database", num_tasks)
+            if logger.isEnabledFor(logging.DEBUG):
+                jobs = self.scheduler.get_jobs()
+                logger.debug("Currently scheduled jobs: %s", len(jobs))
+                for job in jobs:
+                    next_run = job.next_run_time.strftime('%Y-%m-%d %H:%M:%S') if job.next_run_time else 'None'
+                    logger.debug("Job ID: %s, Next run time: %s", job.id, next_run)
                 
         except Exception as e:
-            logger.error(f"Failed to start scheduler: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Failed to start scheduler: %s", e)
             raise
     
     def stop(self):
@@ -100,78 +131,133 @@ class TaskScheduler:
         logger.info("Stopping scheduler")
         try:
             self.scheduler.shutdown()
+            # The jobs are gone with the scheduler; a restart must add them again
+            self._scheduled_crontabs.clear()
             logger.info("Scheduler shutdown complete")
             
-            # Stop any running tasks
-            running_tasks = list(self._running_tasks.items())
-            logger.info(f"Stopping {len(running_tasks)} running tasks")
-            for task_id, thread in running_tasks:
-                logger.info(f"Waiting for task {task_id} to complete")
-                self.cleanup_task_resources(task_id)
+            # Give all running tasks one shared second to complete. Claims not yet
+            # replaced by a pool future never resolve, and queued runs are cancelled
+            # below, so only wait on runs that are actually executing.
+            running_tasks = dict(self._running_tasks)
+            logger.info("Stopping %s running tasks", len(running_tasks))
+            executing = [future for future in running_tasks.values() if future.running()]
+            _, not_done = wait(executing, timeout=1)
+            if not_done:
+                logger.info("%s tasks still running at shutdown", len(not_done))
+            for task_id, future in running_tasks.items():
+                if self._running_tasks.get(task_id) is future:
+                    self._running_tasks.pop(task_id, None)
+            
+            # Drop queued runs without blocking on the ones still running. Unlike the
+            # old daemon threads, pool workers are still joined at interpreter exit,
+            # so a worker recycle ends once in-flight runs finish or gunicorn's
+            # graceful timeout kills the worker.
+            self._executor.shutdown(wait=False, cancel_futures=True)
         except Exception as e:
-            logger.error(f"Error during scheduler shutdown: {str(e)}")
+            logger.error("Error during scheduler shutdown: %s", e)
             raise
     
-    def schedule_task(self, task: Task):
+    def schedule_task(self, task_id: int, schedule: Optional[str], assume_new: bool = False):
         """Schedule a task to run
         
         Args:
-            task: Task to schedule
+            task_id: ID of the task to schedule
+            schedule: Crontab string; an empty schedule only removes the job
+            assume_new: The task has no job yet (startup loading), so skip looking
+                for one and log per-task progress at DEBUG
         """
-        logger.info(f"Scheduling task {task.id} with schedule: {task.schedule}")
+        log_level = logging.DEBUG if assume_new else logging.INFO
         
-        # Always remove any existing job first
-        try:
-            self.remove_task(task)
-            logger.info(f"Removed existing schedule for task {task.id}")
-        except Exception as e:
-            logger.debug(f"No existing schedule found for task {task.id}: {str(e)}")
+        # Nothing to do if the job already runs on this schedule
+        if schedule and self._scheduled_crontabs.get(task_id) == schedule:
+            logger.debug("Task %s is already scheduled with %s", task_id, schedule)
+            return
+        
+        logger.log(log_level, "Scheduling task %s with schedule: %s", task_id, schedule)
         
         # Only schedule if task has a schedule
-        if not task.schedule:
-            logger.info(f"Task {task.id} has no schedule, skipping")
+        if not schedule:
+            # Drop a previous job if there is one; get_job returns None instead of raising
+            if not assume_new and self.scheduler.get_job(str(task_id)) is not None:
+                self.remove_task(task_id)
+                logger.info("Removed existing schedule for task %s", task_id)
+            logger.log(log_level, "Task %s has no schedule, skipping", task_id)
             return
         
         try:
-            # Parse cron schedule for logging
-            trigger = CronTrigger.from_crontab(task.schedule)
-            next_run = trigger.get_next_fire_time(None, datetime.now())
-            
-            # Create new job
-            self.scheduler.add_job(
+            # Create the job, replacing any existing one in place
+            job = self.scheduler.add_job(
                 self.run_task,
-                trigger,
-                args=[task.id],
-                id=str(task.id),
+                _cron_trigger(schedule),
+                args=[task_id],
+                id=str(task_id),
                 replace_existing=True,
                 misfire_grace_time=None  # Disable grace time to prevent misfired jobs from running
             )
-            logger.info(f"Successfully scheduled task {task.id}. Next run at: {next_run}")
+            self._scheduled_crontabs[task_id] = schedule
+            # APScheduler computes the next fire time when the job is added
+            # (left unset while the scheduler is stopped)
+            logger.log(log_level, "Successfully scheduled task %s. Next run at: %s",
+                       task_id, getattr(job, 'next_run_time', None))
             
         except Exception as e:
-            logger.error(f"Failed to schedule task {task.id}: {str(e)}")
-            logger.debug(f"Schedule string: {task.schedule}")
+            logger.error("Failed to schedule task %s: %s", task_id, e)
+            logger.debug("Schedule string: %s", schedule)
             raise
     
-    def remove_task(self, task: Task):
+    def schedule_tasks(self, tasks, assume_new: bool = False) -> int:
+        """Schedule many tasks in one batch
+        
+        Job processing is paused while the jobs are added, so APScheduler wakes
+        up once for the whole batch instead of once per job.
+        
+        Args:
+            tasks: Iterable of (task_id, schedule) pairs
+            assume_new: None of the tasks has a job yet (see schedule_task)
+            
+        Returns:
+            Number of tasks processed
+        """
+        count = 0
+        paused = self.scheduler.state == STATE_RUNNING
+        if paused:
+            self.scheduler.pause()
+        try:
+            for task_id, schedule in tasks:
+                count += 1
+                try:
+                    self.schedule_task(task_id, schedule, assume_new=assume_new)
+                except Exception as e:
+                    logger.exception("Failed to schedule task %s: %s", task_id, e)
+                    continue
+        finally:
+            if paused:
+                self.scheduler.resume()
+        return count
+    
+    def remove_task(self, task_id: int):
         """Remove a task from the scheduler
         
         Args:
-            task: Task to remove
+            task_id: ID of the task to remove
         """
-        logger.info(f"Removing task {task.id} from scheduler")
+        logger.info("Removing task %s from scheduler", task_id)
+        self._scheduled_crontabs.pop(task_id, None)
         try:
             # Remove the job
-            self.scheduler.remove_job(str(task.id))
-            logger.info(f"Successfully removed task {task.id} from scheduler")
+            self.scheduler.remove_job(str(task_id))
+            logger.info("Successfully removed task %s from scheduler", task_id)
             
             # Also remove from running tasks if it's there
-            if task.id in self._running_tasks:
-                thread = self._running_tasks.pop(task.id)
-                logger.info(f"Removed task {task.id} from running tasks. Thread alive: {thread.is_alive()}")
+            future = self._running_tasks.pop(task_id, None)
+            if future is not None:
+                logger.info("Removed task %s from running tasks. Still running: %s", task_id, future.running())
                 
+        except JobLookupError:
+            # Expected for tasks that were never scheduled
+            logger.debug("Task %s was not scheduled", task_id)
         except Exception as e:
-            logger.debug(f"Error removing task {task.id} (may not have been scheduled): {str(e)}")
+            logger.error("Error removing task %s from scheduler: %s", task_id, e, exc_info=True)
             raise
     
     def run_task(self, task_id: int):
@@ -181,75 +267,69 @@ class TaskScheduler:
             task_id: ID of the task to run
         """
         if not self.app:
-            logger.error(f"Cannot run task {task_id}: Flask app not initialized")
+            logger.error("Cannot run task %s: Flask app not initialized", task_id)
             return
             
-        logger.info(f"Initiating task run for task {task_id}")
+        logger.info("Initiating task run for task %s", task_id)
         
-        # Check if task is already running
-        if task_id in self._running_tasks:
-            logger.warning(f"Task {task_id} is already running, skipping this execution")
-            thread = self._running_tasks[task_id]
-            logger.debug(f"Running thread info - Alive: {thread.is_alive()}, Name: {thread.name}")
+        # Claim the task's slot atomically; a concurrent fire finds it taken
+        claim = Future()
+        current = self._running_tasks.setdefault(task_id, claim)
+        if current is not claim:
+            logger.warning("Task %s is already running, skipping this execution", task_id)
+            logger.debug("Running task info - Running: %s, Done: %s", current.running(), current.done())
+            return
+        
+        # Back-pressure: the claim above counts towards the limit
+        if len(self._running_tasks) > self._max_inflight:
+            logger.warning("Task %s skipped: %s runs already in flight (limit %s)",
+                           task_id, len(self._running_tasks) - 1, self._max_inflight)
+            self._task_done(task_id, claim)
             return
         
         # Get task
         try:
             with self.app.app_context():
-                task = Task.query.get(task_id)
-                if not task:
-                    logger.error(f"Task {task_id} not found in database")
+                # Mark the task running and fetch its name in one round-trip
+                task_name = db.session.execute(
+                    update(Task)
+                    .where(Task.id == task_id)
+                    .values(status='running', last_run=datetime.utcnow())
+                    .returning(Task.name)
+                ).scalar_one_or_none()
+                if task_name is None:
+                    logger.error("Task %s not found in database", task_id)
+                    self._task_done(task_id, claim)
                     return
-                
-                logger.info(f"Starting execution of task {task_id} - {task.name}")
-                
-                # Update task status
-                task.status = 'running'
-                task.last_run = datetime.utcnow()
                 db.session.commit()
-                logger.info(f"Updated task {task_id} status to 'running'")
+                
+                logger.info("Starting execution of task %s - %s", task_id, task_name)
+                logger.info("Updated task %s status to 'running'", task_id)
             
-            # Create thread to run the task
-            thread = threading.Thread(
-                target=self._run_task_thread,
-                args=(task_id,),
-                name=f"Task-{task_id}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
-            )
-            thread.daemon = True
-            self._running_tasks[task_id] = thread
-            thread.start()
-            logger.info(f"Started thread {thread.name} for task {task_id}")
+            # Hand the run to the worker pool; its future replaces the claim
+            future = self._executor.submit(self._run_task_thread, task_id)
+            self._running_tasks[task_id] = future
+            future.add_done_callback(lambda f, task_id=task_id: self._task_done(task_id, f))
+            logger.info("Submitted task %s to the worker pool", task_id)
             
         except Exception as e:
-            logger.error(f"Error initiating task {task_id}: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error initiating task %s: %s", task_id, e)
+            self._task_done(task_id, claim)
             try:
                 with self.app.app_context():
-                    task = Task.query.get(task_id)
+                    task = db.session.get(Task, task_id)
                     if task:
                         task.status = 'failed'
                         db.session.commit()
-                        logger.info(f"Updated task {task_id} status to 'failed'")
+                        logger.info("Updated task %s status to 'failed'", task_id)
             except Exception as inner_e:
-                logger.error(f"Failed to update task status: {str(inner_e)}")
+                logger.error("Failed to update task status: %s", inner_e)
     
-    def cleanup_task_resources(self, task_id):
-        """Clean up all resources associated with a task"""
-        with self._cleanup_lock:
-            if task_id in self._running_tasks:
-                thread = self._running_tasks.pop(task_id)
-                try:
-                    # Only try to join if this isn't the current thread
-                    current_thread = threading.current_thread()
-                    if thread is not current_thread:
-                        if thread.is_alive():
-                            thread.join(timeout=1)
-                        logger.info(f"Successfully joined thread for task {task_id}")
-                except Exception as e:
-                    logger.error(f"Error while joining task thread {task_id}: {str(e)}")
-                finally:
-                    # Always remove from running tasks, even if join failed
-                    logger.info(f"Cleaned up resources for task {task_id}")
+    def _task_done(self, task_id: int, future: Future):
+        """Drop a finished run from the running tasks, unless a newer run replaced it"""
+        if self._running_tasks.get(task_id) is future:
+            self._running_tasks.pop(task_id, None)
+            logger.debug("Cleaned up resources for task %s", task_id)
     
     def _run_task_thread(self, task_id: int):
         """Execute task in a thread
@@ -258,38 +338,37 @@ class TaskScheduler:
             task_id: ID of the task to run
         """
         thread_name = threading.current_thread().name
-        logger.info(f"Thread {thread_name} starting execution of task {task_id}")
+        logger.info("Thread %s starting execution of task %s", thread_name, task_id)
         
+        # The worker's app context is already pushed (see _init_worker)
         try:
-            with self.app.app_context():
-                task = Task.query.get(task_id)
-                if not task:
-                    logger.error(f"Task {task_id} not found when starting thread execution")
-                    return
-                
-                # Execute task
-                asyncio.run(self._execute_task(task))
-                
-                # Update status
-                task.status = 'completed'
-                task.last_run = datetime.utcnow()
-                db.session.commit()
-                logger.info(f"Task {task_id} completed successfully")
-                
+            task = db.session.get(Task, task_id)
+            if not task:
+                logger.error("Task %s not found when starting thread execution", task_id)
+                return
+            
+            # Execute task on this worker's event loop
+            self._worker_state.loop.run_until_complete(self._execute_task(task))
+            
+            # Update status and commit it along with the stored results
+            task.status = 'completed'
+            task.last_run = datetime.utcnow()
+            db.session.commit()
+            logger.info("Task %s completed successfully", task_id)
+            
         except Exception as e:
-            logger.error(f"Error in task thread {task_id}: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error in task thread %s: %s", task_id, e)
             try:
-                with self.app.app_context():
-                    task = Task.query.get(task_id)
-                    if task:
-                        task.update_status('failed')
+                db.session.rollback()
+                task = db.session.get(Task, task_id)
+                if task:
+                    task.update_status('failed')
             except Exception as inner_e:
-                logger.error(f"Failed to update task status: {str(inner_e)}")
-            
+                logger.error("Failed to update task status: %s", inner_e)
+        
         finally:
-            # Always clean up resources
-            self.cleanup_task_resources(task_id)
+            # Start the next run on this thread with a fresh session
+            db.session.remove()
     
     async def _execute_task(self, task: Task):
         """Execute a task
@@ -297,27 +376,25 @@ class TaskScheduler:
         Args:
             task: Task to execute
         """
-        logger.info(f"Beginning block chain execution for task {task.id}")
+        logger.info("Beginning block chain execution for task %s", task.id)
         try:
             # Log block chain information
             blocks = task.blocks
-            logger.info(f"Task {task.id} has {len(blocks)} blocks to execute")
-            for block in blocks:
-                logger.info(f"Block: {block.name} (Type: {block.type})")
+            logger.info("Task %s has %s blocks to execute", task.id, len(blocks))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Task %s blocks: %s", task.id,
+                             ", ".join(f"{block.name} ({block.type})" for block in blocks))
             
             # Execute block chain
-            logger.info(f"Executing block chain for task {task.id}")
+            logger.info("Executing block chain for task %s", task.id)
             results = await manager.execute_block_chain(task)
             
-            # Store results
-            logger.info(f"Storing results for task {task.id}")
+            # Store results; committed together with the final task status
+            logger.info("Storing results for task %s", task.id)
             task.set_block_data(results)
-            db.session.commit()
-            logger.info(f"Successfully stored results for task {task.id}")
             
         except Exception as e:
-            logger.error(f"Error executing block chain for task {task.id}: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error executing block chain for task %s: %s", task.id, e)
             raise
 
 # Global instance
@@ -1,8 +1,92 @@
-from typing import Any, Dict, Optional, Tuple, Union
+from functools import lru_cache
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple, Union
 
 from models import Block, BlockConnection
 from blocks.manager import manager
 
+# Marks a parameter that has no default / was not supplied
+_MISSING = object()
+
+# Most error messages reported for one save; any further errors are only counted
+MAX_ERRORS = 100
+
+class _ErrorCollector:
+    """Collects error messages, keeping the first MAX_ERRORS and counting the rest"""
+    
+    def __init__(self):
+        self._messages = []
+        self.skipped = 0
+    
+    def add(self, message: str) -> None:
+        if len(self._messages) < MAX_ERRORS:
+            self._messages.append(message)
+        else:
+            self.skipped += 1
+    
+    def finish(self) -> list:
+        """Get the collected errors as a list, with a summary of any dropped ones"""
+        errors = list(self._messages)
+        if self.skipped:
+            errors.append(f"... and {self.skipped} more errors")
+        return errors
+
+def _parse_boolean(value: Any) -> bool:
+    # JSON payloads may already carry real booleans
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
+
+def _passthrough(value: Any) -> Any:
+    return value
+
+# Value converters by parameter type; unknown types are passed through unchanged
+_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    'integer': int,
+    'float': float,
+    'boolean': _parse_boolean,
+    'string': _passthrough,
+}
+
+# Block types each source type may connect to. Input and processing blocks feed
+# processing or action blocks; action blocks cannot have outgoing connections.
+_VALID_TARGETS: Dict[str, frozenset] = {
+    'input': frozenset({'processing', 'action'}),
+    'processing': frozenset({'processing', 'action'}),
+    'action': frozenset(),
+}
+
+class _ParamSpec(NamedTuple):
+    """A block parameter definition normalized for validation"""
+    name: str
+    convert: Callable[[Any], Any]
+    required: bool
+    default: Any  # _MISSING when the parameter has no default
+
+@lru_cache(maxsize=None)
+def _get_param_schema(block_type: str, block_name: str) -> Tuple[_ParamSpec, ...]:
+    """Get the compiled parameter schema of a block class
+    
+    Block classes are loaded once by the manager, so each (type, name) is
+    compiled once into _ParamSpec tuples.
+    
+    Raises:
+        ValueError: If the block does not exist
+    """
+    block_class = manager.get_block(block_type, block_name)
+    if not block_class:
+        raise ValueError(f"{block_type.title()} block {block_name} not found")
+    return tuple(
+        _ParamSpec(
+            name,
+            _CONVERTERS.get(config.get('type'), _passthrough),
+            bool(config.get('required', False)),
+            config.get('default', _MISSING)
+        )
+        for name, config in block_class().parameters.items()
+    )
+
 class BlockValidationService:
     """Service for validating blocks and their connections"""
     
@@ -25,25 +109,19 @@ class BlockValidationService:
         Raises:
             ValueError: If required parameters are missing or invalid
         """
-        block_class = manager.get_block(block_type, block_name)
-        if not block_class:
-            raise ValueError(f"{block_type.title()} block {block_name} not found")
-        
-        block = block_class()
         validated_params = {}
-        block_params = block.parameters
         
-        for name, config in block_params.items():
-            if name in parameters:
+        for name, convert, required, default in _get_param_schema(block_type, block_name):
+            value = parameters.get(name, _MISSING)
+            if value is not _MISSING:
                 try:
-                    validated_params[name] = BlockValidationService._convert_parameter_value(
-                        parameters[name], config['type'])
+                    validated_params[name] = convert(value)
                 except (ValueError, TypeError) as e:
                     raise ValueError(f"Invalid value for parameter {name}: {str(e)}")
-            elif config.get('required', False):
+            elif required:
                 raise ValueError(f"Required parameter {name} is missing")
-            elif 'default' in config:
-                validated_params[name] = config['default']
+            elif default is not _MISSING:
+                validated_params[name] = default
         
         return validated_params
     
@@ -61,13 +139,7 @@ class BlockValidationService:
         Raises:
             ValueError: If value cannot be converted to target type
         """
-        if param_type == 'integer':
-            return int(value)
-        elif param_type == 'float':
-            return float(value)
-        elif param_type == 'boolean':
-            return value.lower() == 'true'
-        return value
+        return _CONVERTERS.get(param_type, _passthrough)(value)
     
     @staticmethod
     def validate_connection(source_block: Block, target_block: Block) -> bool:
@@ -80,19 +152,9 @@ class BlockValidationService:
         Returns:
             True if connection is valid, False otherwise
         """
-        # Input blocks can only connect to processing or action blocks
-        if source_block.type == 'input':
-            return target_block.type in ['processing', 'action']
-        
-        # Processing blocks can only connect to processing or action blocks
-        if source_block.type == 'processing':
-            return target_block.type in ['processing', 'action']
-        
-        # Action blocks cannot have outgoing connections
-        if source_block.type == 'action':
-            return False
-        
-        return True
+        targets = _VALID_TARGETS.get(source_block.type)
+        # Unknown source types are not restricted
+        return targets is None or target_block.type in targets
 
 class BlockProcessor:
     """Service for processing block data"""
@@ -115,56 +177,115 @@ class BlockProcessor:
         Returns:
             Tuple of (dictionary of processed blocks, list of errors)
         """
+        if existing_blocks:
+            return BlockProcessor._process_blocks_update(task, blocks_data, session, existing_blocks)
+        return BlockProcessor._process_blocks_create(task, blocks_data, session)
+    
+    @staticmethod
+    def _process_blocks_create(
+        task: 'Task',
+        blocks_data: Dict[str, Any],
+        session: Any
+    ) -> Tuple[Dict[str, Block], list]:
+        """Create every block in the block data for a task with no existing blocks"""
+        blocks = {}
+        errors = _ErrorCollector()
+        new_blocks = []
+        
+        for block_data in blocks_data['blocks']:
+            try:
+                block = BlockProcessor._create_block(task, block_data)
+                new_blocks.append(block)
+                
+                if BlockProcessor._apply_parameters(block, block_data, errors):
+                    blocks[block_data['id']] = block
+                
+            except Exception as e:
+                errors.add(f"Error processing block {block_data.get('name')}: {str(e)}")
+        
+        BlockProcessor._flush_new_blocks(session, new_blocks, errors)
+        return blocks, errors.finish()
+    
+    @staticmethod
+    def _process_blocks_update(
+        task: 'Task',
+        blocks_data: Dict[str, Any],
+        session: Any,
+        existing_blocks: Dict[Tuple[str, str], Block]
+    ) -> Tuple[Dict[str, Block], list]:
+        """Update, create and remove blocks to match the block data of an existing task"""
         blocks = {}
-        errors = []
+        errors = _ErrorCollector()
         used_blocks = set()
+        new_blocks = []
         
         for block_data in blocks_data['blocks']:
             try:
                 block_key = (block_data['name'], block_data['type'])
+                block = existing_blocks.get(block_key)
                 
-                if existing_blocks and block_key in existing_blocks:
+                if block is not None:
                     # Update existing block
-                    block = existing_blocks[block_key]
                     block.display_name = block_data.get('display_name')
                     block.position_x = block_data.get('position_x', 0)
                     block.position_y = block_data.get('position_y', 0)
                     used_blocks.add(block_key)
                 else:
-                    # Create new block
-                    block = Block(
-                        task_id=task.id,
-                        name=block_data['name'],
-                        type=block_data['type'],
-                        display_name=block_data.get('display_name'),
-                        position_x=block_data.get('position_x', 0),
-                        position_y=block_data.get('position_y', 0)
-                    )
-                    session.add(block)
-                
-                # Validate and set parameters
-                if 'parameters' in block_data:
-                    try:
-                        block_params = BlockValidationService.validate_parameters(
-                            block.name, block.type, block_data['parameters'])
-                        block.set_parameters(block_params)
-                    except ValueError as e:
-                        errors.append(str(e))
-                        continue
+                    block = BlockProcessor._create_block(task, block_data)
+                    new_blocks.append(block)
                 
-                session.flush()
-                blocks[block_data['id']] = block
+                if BlockProcessor._apply_parameters(block, block_data, errors):
+                    blocks[block_data['id']] = block
                 
             except Exception as e:
-                errors.append(f"Error processing block {block_data.get('name')}: {str(e)}")
+                errors.add(f"Error processing block {block_data.get('name')}: {str(e)}")
         
-        # Remove unused blocks if updating
-        if existing_blocks:
-            for block_key, block in existing_blocks.items():
-                if block_key not in used_blocks:
-                    session.delete(block)
+        BlockProcessor._flush_new_blocks(session, new_blocks, errors)
         
-        return blocks, errors
+        # Remove unused blocks
+        for block_key in existing_blocks.keys() - used_blocks:
+            session.delete(existing_blocks[block_key])
+        
+        return blocks, errors.finish()
+    
+    @staticmethod
+    def _create_block(task: 'Task', block_data: Dict[str, Any]) -> Block:
+        """Build a new block for a task from its block data"""
+        return Block(
+            task_id=task.id,
+            name=block_data['name'],
+            type=block_data['type'],
+            display_name=block_data.get('display_name'),
+            position_x=block_data.get('position_x', 0),
+            position_y=block_data.get('position_y', 0)
+        )
+    
+    @staticmethod
+    def _apply_parameters(block: Block, block_data: Dict[str, Any], errors: _ErrorCollector) -> bool:
+        """Validate and set block parameters, recording any error
+        
+        Returns:
+            True if the parameters were valid or absent, False otherwise
+        """
+        if 'parameters' in block_data:
+            try:
+                block_params = BlockValidationService.validate_parameters(
+                    block.name, block.type, block_data['parameters'])
+                block.set_parameters(block_params)
+            except ValueError as e:
+                errors.add(str(e))
+                return False
+        return True
+    
+    @staticmethod
+    def _flush_new_blocks(session: Any, new_blocks: list, errors: _ErrorCollector) -> None:
+        """Insert all new blocks with a single flush"""
+        if new_blocks:
+            session.add_all(new_blocks)
+            try:
+                session.flush()
+            except Exception as e:
+                errors.add(f"Error saving blocks: {str(e)}")
     
     @staticmethod
     def process_connections(
@@ -182,13 +303,18 @@ class BlockProcessor:
         Returns:
             List of errors encountered during processing
         """
-        errors = []
+        errors = _ErrorCollector()
+        conn_rows = []
         blocks_list = list(blocks.values())
         
-        # Delete existing connections if updating
-        for block in blocks_list:
-            for conn in block.inputs:
-                session.delete(conn)
+        # Delete existing connections if updating. Flush first so new blocks
+        # have ids and removed blocks take their connections with them.
+        session.flush()
+        block_ids = [block.id for block in blocks_list]
+        if block_ids:
+            session.query(BlockConnection).filter(
+                BlockConnection.target_block_id.in_(block_ids)
+            ).delete(synchronize_session='fetch')
         
         # Process new connections
         for conn_data in blocks_data['connections']:
@@ -196,27 +322,36 @@ class BlockProcessor:
                 source_index = int(conn_data['source'])
                 target_index = int(conn_data['target'])
                 
-                if not (0 <= source_index < len(blocks_list) and 0 <= target_index < len(blocks_list)):
+                # Negative indices would silently wrap around the list
+                if source_index < 0 or target_index < 0:
                     error_msg = f"Invalid connection indices: source={source_index}, target={target_index}"
-                    errors.append(error_msg)
+                    errors.add(error_msg)
                     continue
                 
-                source_block = blocks_list[source_index]
-                target_block = blocks_list[target_index]
+                try:
+                    source_block = blocks_list[source_index]
+                    target_block = blocks_list[target_index]
+                except IndexError:
+                    error_msg = f"Invalid connection indices: source={source_index}, target={target_index}"
+                    errors.add(error_msg)
+                    continue
                 
                 if not BlockValidationService.validate_connection(source_block, target_block):
                     error_msg = f"Invalid connection between {source_block.type} block and {target_block.type} block"
-                    errors.append(error_msg)
+                    errors.add(error_msg)
                     continue
                 
-                conn = BlockConnection(
-                    source_block_id=source_block.id,
-                    target_block_id=target_block.id,
-                    input_name=conn_data.get('input_name')
-                )
-                session.add(conn)
+                conn_rows.append({
+                    'source_block_id': source_block.id,
+                    'target_block_id': target_block.id,
+                    'input_name': conn_data.get('input_name')
+                })
                 
             except (ValueError, KeyError) as e:
-                errors.append(f"Error processing connection: {str(e)}")
+                errors.add(f"Error processing connection: {str(e)}")
+        
+        # Insert all valid connections in one batch, bypassing the unit of work
+        if conn_rows:
+            session.bulk_insert_mappings(BlockConnection, conn_rows)
         
-        return errors 
\ No newline at end of file
+        return errors.finish() 
\ No newline at end of file